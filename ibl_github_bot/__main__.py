@@ -43,7 +43,37 @@ load_dotenv(find_dotenv())
     default=None,
     help="Username associated with the github token"
 )
-def main(repo: str, branch: str, github_token: str, github_username: str, cleanup: bool = True, file: list[str]=None):
+@click.option(
+    "--batch-tokens",
+    type=int,
+    default=0,
+    help="Group small target files into a single model request of up to this many tokens. Defaults to 0 (one request per file).",
+)
+@click.option(
+    "--commit-policy",
+    type=click.Choice(["single", "module"]),
+    default="single",
+    help="Create a single commit for all generated tests or one commit per module.",
+)
+@click.option(
+    "--coverage",
+    is_flag=True,
+    default=False,
+    help="Run the existing tests under coverage first and generate tests for the least covered files first.",
+)
+@click.option(
+    "--max-files",
+    type=int,
+    default=0,
+    help="Maximum number of files to generate tests for. Defaults to 0 (unlimited).",
+)
+@click.option(
+    "--max-tokens",
+    type=int,
+    default=0,
+    help="Maximum number of estimated tokens to spend on generation. Defaults to 0 (unlimited).",
+)
+def main(repo: str, branch: str, github_token: str, github_username: str, cleanup: bool = True, file: list[str]=None, batch_tokens: int = 0, commit_policy: str = "single", coverage: bool = False, max_files: int = 0, max_tokens: int = 0):
     if not github_token:
         github_token = os.getenv("GH_TOKEN")
     if not github_token:
@@ -60,7 +90,9 @@ def main(repo: str, branch: str, github_token: str, github_username: str, cleanu
     loop.run_until_complete(
         create_tests_for_repo(
             github_username, repo, branch, token=github_token, cleanup=cleanup,
-            target_files=file
+            target_files=file, batch_token_limit=batch_tokens,
+            commit_policy=commit_policy, use_coverage=coverage,
+            max_files=max_files, max_tokens=max_tokens,
         )
     )
 
@@ -0,0 +1,214 @@
+import ast
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from ibl_github_bot.test_index import is_test_file
+
+logger = logging.getLogger(__name__)
+
+# maximum time in seconds allowed for the existing test suite to run under coverage.
+DEFAULT_COVERAGE_TIMEOUT = 30 * 60
+
+# the only environment variables passed on to the target repository's tests. The
+# bot's own secrets (GH_TOKEN, GH_AUTH, OPENAI_API_KEY, ...) must never reach code
+# from the repository under test.
+SAFE_ENV_VARS = ("PATH", "HOME", "LANG", "LC_ALL", "LC_CTYPE", "TMPDIR", "VIRTUAL_ENV")
+
+
+def coverage_env(coverage_file: Path) -> dict[str, str]:
+    """Minimal environment for running the target repository's tests under coverage."""
+    env = {name: os.environ[name] for name in SAFE_ENV_VARS if name in os.environ}
+    env["COVERAGE_FILE"] = str(coverage_file)
+    return env
+
+
+def format_line_ranges(lines: list[int]) -> str:
+    """Formats line numbers as compact ranges. eg. [1, 2, 3, 7] -> "1-3, 7" """
+    ranges = []
+    for line in sorted(set(lines)):
+        if ranges and line == ranges[-1][1] + 1:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return ", ".join(
+        str(start) if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+
+class CoverageReport:
+    """
+    Line coverage of a repository's existing test suite.
+
+    `files` maps paths relative to the repository root to the coverage.py json
+    entry for that file (`summary` and `missing_lines`). Files the test suite never
+    imported are absent and treated as having no coverage.
+    """
+
+    def __init__(self, root: Path, files: dict[str, dict]):
+        self.root = root
+        self.files = files
+
+    @classmethod
+    def collect(
+        cls, root: Path, timeout: int = DEFAULT_COVERAGE_TIMEOUT
+    ) -> "CoverageReport | None":
+        """
+        Runs the repository's existing tests under coverage in a subprocess.
+
+        This executes code from the target repository. The tests are run with the
+        current interpreter and only the variables in `SAFE_ENV_VARS`, so the
+        repository's dependencies, `coverage` and `pytest` must be installed for the
+        report to be meaningful. Failing tests are fine; returns None if no report could
+        be produced.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            env = coverage_env(Path(tmp) / ".coverage")
+            report_file = Path(tmp) / "coverage.json"
+            commands = [
+                [sys.executable, "-m", "coverage", "run", "--source", ".", "-m", "pytest", "-q"],
+                [sys.executable, "-m", "coverage", "json", "-q", "-o", str(report_file)],
+            ]
+            for command in commands:
+                try:
+                    result = subprocess.run(
+                        command,
+                        cwd=root,
+                        env=env,
+                        capture_output=True,
+                        text=True,
+                        timeout=timeout,
+                    )
+                except (OSError, subprocess.TimeoutExpired) as e:
+                    logger.warning("Failed to collect coverage for %s: %s", root, e)
+                    return None
+                logger.debug("%s\n%s", " ".join(command), result.stdout)
+            if not report_file.exists():
+                logger.warning(
+                    "Failed to collect coverage for %s:\n%s", root, result.stderr
+                )
+                return None
+            with open(report_file) as f:
+                data = json.load(f)
+        report = cls.from_json(root, data)
+        logger.info("Collected coverage for %d files", len(report.files))
+        return report
+
+    @classmethod
+    def from_json(cls, root: Path, data: dict) -> "CoverageReport":
+        """
+        Builds a report from coverage.py json output.
+
+        Test files are left out: they are almost fully covered by definition and would
+        make modules with many tests look well covered.
+        """
+        files = {}
+        for filename, entry in data.get("files", {}).items():
+            path = Path(filename)
+            if is_test_file(path) or "tests" in path.parts[:-1]:
+                continue
+            files[str(path)] = entry
+        return cls(root, files)
+
+    def _key(self, path: Path) -> str:
+        path = Path(path)
+        if path.is_absolute():
+            path = path.relative_to(self.root)
+        return str(path)
+
+    def percent_covered(self, path: Path) -> float:
+        entry = self.files.get(self._key(path))
+        if not entry:
+            return 0.0
+        return entry["summary"]["percent_covered"]
+
+    def missing_lines(self, path: Path, source: str) -> list[int]:
+        entry = self.files.get(self._key(path))
+        if entry:
+            return entry["missing_lines"]
+        # never imported by the test suite, every line is uncovered.
+        return [
+            i + 1 for i, line in enumerate(source.splitlines()) if line.strip()
+        ]
+
+    def uncovered_functions(self, path: Path, source: str) -> list[str]:
+        """Returns qualified names of functions containing at least one uncovered line."""
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return []
+        missing = set(self.missing_lines(path, source))
+        names = []
+
+        def visit(node: ast.AST, prefix: str):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    lines = range(child.lineno, (child.end_lineno or child.lineno) + 1)
+                    if missing.intersection(lines):
+                        names.append(prefix + child.name)
+                    visit(child, prefix + child.name + ".")
+                elif isinstance(child, ast.ClassDef):
+                    visit(child, prefix + child.name + ".")
+
+        visit(tree, "")
+        return names
+
+    def module_coverage(self, module: str) -> float:
+        """Average coverage of the measured files within a top-level directory."""
+        percents = [
+            entry["summary"]["percent_covered"]
+            for filename, entry in self.files.items()
+            if Path(filename).parts[0] == module
+        ]
+        if not percents:
+            return 0.0
+        return sum(percents) / len(percents)
+
+    def describe(self, path: Path, source: str) -> str:
+        """Describes the uncovered parts of a file for inclusion in the prompt."""
+        missing = self.missing_lines(path, source)
+        if not missing:
+            return ""
+        description = "Existing tests cover %.0f%% of %s. Uncovered lines: %s." % (
+            self.percent_covered(path),
+            self._key(path),
+            format_line_ranges(missing),
+        )
+        functions = self.uncovered_functions(path, source)
+        if functions:
+            description += " Uncovered functions: %s." % ", ".join(functions)
+        return description + " Focus the generated tests on the uncovered code."
+
+
+class GenerationBudget:
+    """
+    Limits the number of files and estimated tokens spent on a test generation run.
+
+    A limit of 0 means unlimited. The budget is checked before every request, so the
+    last request may overshoot the token limit.
+    """
+
+    def __init__(self, max_files: int = 0, max_tokens: int = 0):
+        self.max_files = max_files
+        self.max_tokens = max_tokens
+        self.files = 0
+        self.tokens = 0
+
+    def exhausted(self) -> bool:
+        return bool(
+            (self.max_files and self.files >= self.max_files)
+            or (self.max_tokens and self.tokens >= self.max_tokens)
+        )
+
+    def remaining_files(self) -> int | None:
+        if not self.max_files:
+            return None
+        return max(self.max_files - self.files, 0)
+
+    def consume(self, files: int = 0, tokens: int = 0):
+        self.files += files
+        self.tokens += tokens
@@ -0,0 +1,151 @@
+import ast
+import logging
+import tokenize
+from collections import defaultdict
+from pathlib import Path
+
+from ibl_github_bot.configuration import HARD_EXCLUDE
+
+logger = logging.getLogger(__name__)
+
+# test files must be indexed, so only the non-test hard excludes are skipped.
+SKIP_DIRS = [d for d in HARD_EXCLUDE if d not in ("tests", "tests.py")]
+
+
+def is_test_file(path: Path) -> bool:
+    return path.suffix == ".py" and (
+        path.name.startswith("test_")
+        or path.name.endswith("_test.py")
+        or path.name == "tests.py"
+    )
+
+
+class ExistingTestIndex:
+    """
+    Maps source files of a repository to their existing test files.
+
+    Test files are matched to a source file in two ways, kept apart because only the
+    first kind is overwritten by generated tests:
+        - by name, when it follows the `<dir>/tests/test_<path relative to dir>` naming
+          used by `generate_tests` (or sits next to the source as `test_<name>.py`).
+        - by import, when it imports the source module, directly or through a
+          relative import.
+
+    The index is built once per run and test file contents are read only once, so each
+    request can include just the tests that belong to its target files.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.sources: set[Path] = set()
+        self.test_files: set[Path] = set()
+        self.named: defaultdict[Path, set[Path]] = defaultdict(set)
+        self.imported: defaultdict[Path, set[Path]] = defaultdict(set)
+        self._contents: dict[Path, str] = {}
+
+    @classmethod
+    def build(cls, root: Path, exclude: list[str] | None = None) -> "ExistingTestIndex":
+        """
+        Indexes the repository at `root`.
+
+        `exclude` is the configured list of excluded files and directories. Test
+        directories are always indexed, so `tests` and `tests.py` entries are ignored.
+        """
+        exclude = [
+            entry for entry in exclude or [] if entry not in ("tests", "tests.py")
+        ]
+        index = cls(root)
+        for path in root.rglob("*.py"):
+            relative = path.relative_to(root)
+            if any(
+                part in SKIP_DIRS or part.startswith(".")
+                for part in relative.parts[:-1]
+            ):
+                continue
+            if any(
+                entry in relative.parts or relative.is_relative_to(entry)
+                for entry in exclude
+            ):
+                continue
+            if is_test_file(path):
+                index.test_files.add(path)
+            else:
+                index.sources.add(path)
+
+        expected = index._expected_test_paths()
+        for test_file in sorted(index.test_files):
+            try:
+                tree = ast.parse(index.read(test_file))
+            except (SyntaxError, ValueError, UnicodeDecodeError) as e:
+                logger.warning("Skipping unreadable test file %s: %s", test_file, e)
+                index.test_files.discard(test_file)
+                continue
+            for source in expected.get(test_file, []):
+                index.named[source].add(test_file)
+            for source in index._imported_sources(test_file, tree):
+                index.imported[source].add(test_file)
+        logger.info(
+            "Indexed %d existing test files covering %d source files",
+            len(index.test_files),
+            len(index.named.keys() | index.imported.keys()),
+        )
+        return index
+
+    def _expected_test_paths(self) -> dict[Path, list[Path]]:
+        expected = defaultdict(list)
+        for source in self.sources:
+            expected[source.parent / ("test_" + source.name)].append(source)
+            for parent in source.parents:
+                if parent == self.root or not parent.is_relative_to(self.root):
+                    break
+                name = "test_" + str(source.relative_to(parent)).replace("/", "_")
+                expected[parent / "tests" / name].append(source)
+        return expected
+
+    def _module_files(self, module: str) -> list[Path]:
+        base = self.root.joinpath(*module.split("."))
+        return [
+            path
+            for path in (base.with_suffix(".py"), base / "__init__.py")
+            if path in self.sources
+        ]
+
+    def _imported_sources(self, test_file: Path, tree: ast.AST) -> set[Path]:
+        package = ".".join(test_file.parent.relative_to(self.root).parts)
+        modules = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:
+                    parts = package.split(".") if package else []
+                    if node.level - 1 > len(parts):
+                        continue
+                    parts = parts[: len(parts) - (node.level - 1)]
+                    base = ".".join(filter(None, [*parts, base]))
+                if base:
+                    modules.append(base)
+                # `from package import module` imports a submodule.
+                modules.extend(
+                    ".".join(filter(None, [base, alias.name])) for alias in node.names
+                )
+        sources = set()
+        for module in modules:
+            sources.update(self._module_files(module))
+        return sources
+
+    def read(self, test_file: Path) -> str:
+        if test_file not in self._contents:
+            # honours PEP 263 coding declarations.
+            with tokenize.open(test_file) as f:
+                self._contents[test_file] = f.read()
+        return self._contents[test_file]
+
+    def named_tests_for(self, source: Path) -> list[Path]:
+        """Test files matched to `source` by name."""
+        return sorted(self.named.get(source, ()))
+
+    def imported_tests_for(self, source: Path) -> list[Path]:
+        """Test files importing `source` that are not already matched by name."""
+        return sorted(self.imported.get(source, set()) - self.named.get(source, set()))
@@ -1,4 +1,5 @@
 import random
+import re
 from langchain.chat_models import ChatOpenAI
 from langchain.schema.messages import HumanMessage, SystemMessage
 from langchain.document_loaders import PythonLoader, DirectoryLoader
@@ -14,7 +15,11 @@ import uuid
 from pathlib import Path
 import shutil
 import datetime
+import time
+import asyncio
 from ibl_github_bot.configuration import DependencyGraph
+from ibl_github_bot.coverage_targets import CoverageReport, GenerationBudget
+from ibl_github_bot.test_index import ExistingTestIndex, is_test_file
 from langchain.schema import Document
 import concurrent
 
@@ -23,6 +28,14 @@ logger = logging.getLogger(__name__)
 
 BASE_DIR = Path.cwd() / "cached-repos"
 
+# marker placed by the model in front of every test file of a batched response.
+BATCH_FILE_MARKER = "### TEST FILE:"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for `text` (~4 characters per token)."""
+    return len(text) // 4
+
 
 class CodeParser:
     def parse(self, text: str) -> tuple[str, bool]:
@@ -47,6 +60,29 @@ class CodeParser:
             logging.info("Defaulting text: \n%s", text)
         return text, False
 
+    def parse_many(self, text: str, filenames: list[str]) -> dict[str, tuple[str, bool]]:
+        """
+        Splits a batched response into one test file per requested filename.
+
+        Each section starts with a `BATCH_FILE_MARKER` line naming the source file
+        and is parsed and validated separately. Filenames without a section are
+        reported as failed so that callers can fall back to single-file requests.
+        """
+        results = {filename: ("", False) for filename in filenames}
+        sections = re.split(
+            r"^%s[ \t]*(.+?)[ \t]*$" % re.escape(BATCH_FILE_MARKER),
+            text,
+            flags=re.MULTILINE,
+        )
+        # sections = [preamble, name1, body1, name2, body2, ...]
+        for filename, body in zip(sections[1::2], sections[2::2]):
+            filename = filename.strip("`'\"")
+            if filename not in results:
+                logging.warning("Unexpected file %s in batched response", filename)
+                continue
+            results[filename] = self.parse(body.strip())
+        return results
+
 
 SYTEM_MESSAGE_STR = """You are an experienced {language}, {frameworks} and {test_library} developer. \
 You have been given a set of {language} files in a project written in  {frameworks} and {test_library} \
@@ -137,6 +173,15 @@ Testing library: {test_library}
 Programming Language: {language}
 """
 
+BATCH_MESSAGE_STR = """Generate {test_library} compatible test files for each of the following files:
+{filenames}
+
+Return one test file per listed file. Start every test file with a line of the form
+{marker} <filename>
+followed by the test file wrapped in starting ```{language}\n and ending with \n```
+Do not include any extra content.
+"""
+
 
 class CustomDirectoryLoader(DirectoryLoader):
     """Load from a directory"""
@@ -292,13 +337,32 @@ def generate_tests(
     sub_path: Path = None,
     test_dir: Path = None,
     target_files: list[Path] = None,
-):
+    batch_token_limit: int = 0,
+    coverage_report: CoverageReport | None = None,
+    budget: GenerationBudget | None = None,
+    test_index: ExistingTestIndex | None = None,
+) -> dict[Path, str]:
+    """
+    Generates tests for the target files under `sub_path`.
+
+    When a `coverage_report` is given, the least covered files are generated first and
+    the prompt names their uncovered lines and functions. Generation stops once the
+    shared `budget` is exhausted.
+
+    Existing tests are not part of the shared context; each request only includes the
+    existing tests `test_index` maps to its target files.
+
+    Nothing is written to disk; the generated test files are returned as a mapping of
+    absolute file path to content so that they can be written and committed together
+    by `write_generated_files` and `commit_generated_files`. An empty mapping means no
+    tests were generated.
+    """
     if sub_path == None:
         sub_path = directory
     if test_dir == None:
         test_dir = sub_path / "tests"
     if sub_path.name in dependency_graph.get_global_settings()["exclude"]:
-        return False
+        return {}
     module_name = sub_path.relative_to(directory).name
     exclude_dirs = dependency_graph.get_all_excludes(module_name)
     dependent_modules = dependency_graph.get_all_dependencies(module_name)
@@ -313,10 +377,18 @@ def generate_tests(
         dependent_modules=dependent_modules,
         current_module=module_name,
     ).load()
+    # existing tests are sent only with the requests for the files they test.
+    documents = [
+        document
+        for document in documents
+        if not is_test_file(Path(document.metadata["source"]))
+    ]
+    if test_index is None:
+        test_index = ExistingTestIndex.build(
+            directory, exclude=dependency_graph.get_global_settings()["exclude"]
+        )
 
-    test_dir.mkdir(exist_ok=True)
-    if not (test_dir / "__init__.py").exists():
-        (test_dir / "__init__.py").touch()
+    generated_files: dict[Path, str] = {}
     files_messages = [
         HumanMessage(
             content=[
@@ -361,58 +433,302 @@ def generate_tests(
     if target_files:
         target_documents = [document for document in target_documents if Path(document.metadata["source"]) in target_files]
 
+    if coverage_report:
+        target_documents = sorted(
+            target_documents,
+            key=lambda document: coverage_report.percent_covered(
+                Path(document.metadata["source"])
+            ),
+        )
+    if budget and budget.remaining_files() is not None:
+        target_documents = target_documents[: budget.remaining_files()]
+
     if not target_documents:
         logger.info("No tests generated for %s", sub_path)
-        return False
-    
-    for document in tqdm.tqdm(target_documents):
+        return {}
+
+    context_tokens = estimate_tokens(system_message.content) + sum(
+        estimate_tokens(message.content[0]["text"]) for message in files_messages
+    )
+
+    def coverage_hint(document: Document) -> str:
+        if not coverage_report:
+            return ""
+        return coverage_report.describe(
+            Path(document.metadata["source"]), document.page_content
+        )
+
+    def output_path(document: Document) -> Path:
+        return test_dir / (
+            "test_"
+            + str(Path(document.metadata["source"]).relative_to(sub_path)).replace(
+                "/", "_"
+            )
+        )
+
+    def existing_tests(batch: list[Document]) -> str:
+        # tests at the output path are overwritten, so the model has to extend them.
+        # any other matching tests stay in place and must not be copied.
+        extend: dict[Path, list[Path]] = {}
+        for document in batch:
+            source = Path(document.metadata["source"])
+            if output_path(document) in test_index.named_tests_for(source):
+                extend[output_path(document)] = [source]
+        reference: dict[Path, list[Path]] = {}
+        for document in batch:
+            source = Path(document.metadata["source"])
+            for test_file in [
+                *test_index.named_tests_for(source),
+                *test_index.imported_tests_for(source),
+            ]:
+                if test_file not in extend:
+                    reference.setdefault(test_file, []).append(source)
+
+        def blocks(tests: dict[Path, list[Path]], relation: str) -> str:
+            return "\n".join(
+                "```%s\n# %s (%s %s)\n%s\n```"
+                % (
+                    global_settings["language"],
+                    test_file.relative_to(directory),
+                    relation,
+                    ", ".join(str(source.relative_to(directory)) for source in sources),
+                    test_index.read(test_file),
+                )
+                for test_file, sources in tests.items()
+            )
+
+        text = ""
+        if extend:
+            text += (
+                "Existing tests to extend. They will be replaced by the generated test "
+                "file of the file they belong to, so include them in that output:\n%s\n\n"
+                % blocks(extend, "tests for")
+            )
+        if reference:
+            text += (
+                "Existing tests for reference only. They are kept in their own files, "
+                "do not copy them into your output:\n%s\n\n"
+                % blocks(reference, "related to")
+            )
+        return text
+
+    def invoke(text: str, files: int):
         msg = chain.invoke(
             [
                 *messages,
-                HumanMessage(
-                    content=[
-                        {
-                            "type": "text",
-                            "text": "Generate {test_library} compatible test file for {filename}".format(
-                                filename=Path(document.metadata["source"]).relative_to(
-                                    directory
-                                ),
-                                test_library=global_settings["test_library"],
-                            ),
-                        }
-                    ]
-                ),
+                HumanMessage(content=[{"type": "text", "text": text}]),
             ]
         )
+        if budget:
+            budget.consume(
+                files=files,
+                tokens=context_tokens
+                + estimate_tokens(text)
+                + estimate_tokens(msg.content),
+            )
+        return msg
+
+    def relative_source(document: Document) -> Path:
+        return Path(document.metadata["source"]).relative_to(directory)
+
+    def save_tests(document: Document, content: str):
+        if not content.strip():
+            logger.info("skipping %s no tests generated", relative_source(document))
+            return
+        logger.info("Generated tests for %s", relative_source(document))
+        generated_files[output_path(document)] = content
+
+    def generate_single(document: Document, files: int = 1):
+        text = existing_tests([document]) + (
+            "Generate {test_library} compatible test file for {filename}".format(
+                filename=relative_source(document),
+                test_library=global_settings["test_library"],
+            )
+        )
+        hint = coverage_hint(document)
+        if hint:
+            text += "\n" + hint
+        msg = invoke(text, files=files)
         content, success = CodeParser().parse(msg.content)
         if not success:
             logger.warning(
                 "Failed to generate test for %s", document.metadata["source"]
             )
+            return
+        save_tests(document, content)
+
+    def generate_batch(batch: list[Document]):
+        filenames = [str(relative_source(document)) for document in batch]
+        text = existing_tests(batch) + BATCH_MESSAGE_STR.format(
+            filenames="\n".join("- %s" % f for f in filenames),
+            test_library=global_settings["test_library"],
+            language=global_settings["language"],
+            marker=BATCH_FILE_MARKER,
+        )
+        hints = [hint for hint in map(coverage_hint, batch) if hint]
+        if hints:
+            text += "\n" + "\n".join(hints)
+        msg = invoke(text, files=len(batch))
+        results = CodeParser().parse_many(msg.content, filenames)
+        for document, filename in zip(batch, filenames):
+            content, success = results[filename]
+            if not success:
+                logger.warning(
+                    "Failed to parse batched tests for %s, retrying as a single request",
+                    filename,
+                )
+                # the file was already counted against the budget by the batch.
+                generate_single(document, files=0)
+                continue
+            save_tests(document, content)
+
+    for batch in tqdm.tqdm(batch_documents(target_documents, batch_token_limit)):
+        if budget and budget.exhausted():
+            logger.info("Generation budget exhausted, skipping remaining files in %s", sub_path)
+            break
+        if len(batch) == 1:
+            generate_single(batch[0])
+        else:
+            generate_batch(batch)
+
+    if generated_files and not (test_dir / "__init__.py").exists():
+        generated_files[test_dir / "__init__.py"] = ""
+    return generated_files
+
+
+def batch_documents(
+    documents: list[Document], token_limit: int = 0
+) -> list[list[Document]]:
+    """
+    Groups small documents into batches whose combined size stays within `token_limit`.
+
+    Documents larger than the limit are placed in a batch of their own.
+    A `token_limit` of 0 disables batching.
+    """
+    if token_limit <= 0:
+        return [[document] for document in documents]
+    batches: list[list[Document]] = []
+    current: list[Document] = []
+    current_tokens = 0
+    for document in documents:
+        tokens = estimate_tokens(document.page_content)
+        if tokens >= token_limit:
+            batches.append([document])
             continue
-        if not content.strip():
-            logger.info(
-                "skipping %s no tests generated",
-                Path(document.metadata["source"]).relative_to(directory),
+        if current and current_tokens + tokens > token_limit:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(document)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+COMMIT_POLICIES = ("single", "module")
+
+
+def write_generated_files(files: dict[Path, str]):
+    """
+    Writes generated files to disk atomically.
+
+    Each file is written to a temporary sibling first and then moved into place,
+    so an interrupted run never leaves a partially written test file behind.
+    """
+    for path, content in files.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(".%s.%s.tmp" % (path.name, uuid.uuid4().hex))
+        try:
+            tmp_path.write_text(content)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+def commit_generated_files(
+    local_repo: git.Repo,
+    local_dir: Path,
+    generated: dict[str, dict[Path, str]],
+    date: str,
+    commit_policy: str = "single",
+) -> list[str]:
+    """
+    Writes, stages and commits generated test files.
+
+    Args:
+        local_repo (git.Repo): The cloned repository.
+        local_dir (Path): Root directory of the cloned repository.
+        generated (dict): Generated files keyed by module name.
+        date (str): Date used in commit messages.
+        commit_policy (str, optional): "single" creates one commit for all modules with
+            a single index update, "module" creates one commit per module. Defaults to "single".
+
+    Returns:
+        list[str]: The created commit messages.
+    """
+    if commit_policy not in COMMIT_POLICIES:
+        raise ValueError(
+            "Invalid commit policy %r, expected one of %s"
+            % (commit_policy, ", ".join(COMMIT_POLICIES))
+        )
+    generated = {module: files for module, files in generated.items() if files}
+    if not generated:
+        return []
+
+    start = time.perf_counter()
+    for files in generated.values():
+        write_generated_files(files)
+    logging.info(
+        "Wrote %d test files in %.2fs",
+        sum(len(files) for files in generated.values()),
+        time.perf_counter() - start,
+    )
+
+    if commit_policy == "single":
+        # fixed subject, the modules are listed in the body as there may be many.
+        groups = [
+            (
+                f"auto-generated tests on {date}\n\nModules:\n"
+                + "\n".join(f"- {module}" for module in generated),
+                [f for files in generated.values() for f in files],
             )
-            continue
-        logger.info(
-            "Generated tests for %s",
-            Path(document.metadata["source"]).relative_to(directory),
+        ]
+    else:
+        groups = [
+            (f"auto-generated tests for {module} on {date}", list(files))
+            for module, files in generated.items()
+        ]
+
+    messages = []
+    for message, files in groups:
+        start = time.perf_counter()
+        local_repo.index.add([str(path.relative_to(local_dir)) for path in files])
+        staged = time.perf_counter()
+        local_repo.index.commit(message)
+        logging.info(
+            "Created commit with message: %s (staged in %.2fs, committed in %.2fs)",
+            message.splitlines()[0],
+            staged - start,
+            time.perf_counter() - staged,
         )
-        with open(
-            test_dir
-            / (
-                "test_"
-                + str(Path(document.metadata["source"]).relative_to(sub_path)).replace(
-                    "/", "_"
-                )
-            ),
-            "w",
-        ) as f:
-            f.write(content)
+        messages.append(message)
+    return messages
 
-    return True
+
+def pull_request_body(generated: dict[str, dict[Path, str]], local_dir: Path) -> str:
+    """Builds the pull request description listing the generated test files."""
+    files = [
+        "- `%s`" % path.relative_to(local_dir)
+        for module_files in generated.values()
+        for path in module_files
+        if path.name != "__init__.py"
+    ]
+    return (
+        "> [!IMPORTANT]\n"
+        "> Remember to check out the pull request and run the tests before merging.\n"
+        "> Thank you.\n\n"
+        "Generated test files:\n" + "\n".join(files)
+    )
 
 
 async def create_tests_for_repo(
@@ -422,6 +738,11 @@ async def create_tests_for_repo(
     token: str = os.getenv("GH_TOKEN"),
     cleanup: bool = True,
     target_files: list[str] | None = None,
+    batch_token_limit: int = 0,
+    commit_policy: str = "single",
+    use_coverage: bool = False,
+    max_files: int = 0,
+    max_tokens: int = 0,
 ):
     """
     Asynchronously creates tests for a repository.
@@ -431,6 +752,11 @@ async def create_tests_for_repo(
         repo (str): The name of the repository.
         branch (str, optional): The branch to clone the repository from. Defaults to "main".
         token (str, optional): The GitHub token used for authentication. Defaults to the value of the "GH_TOKEN" environment variable.
+        batch_token_limit (int, optional): Group target files smaller than this many tokens into a single model request. Defaults to 0 (disabled).
+        commit_policy (str, optional): Either "single" (one commit for all modules) or "module" (one commit per module). Defaults to "single".
+        use_coverage (bool, optional): Run the existing test suite under coverage first and target the least covered files. Defaults to False.
+        max_files (int, optional): Maximum number of files to generate tests for. Defaults to 0 (unlimited).
+        max_tokens (int, optional): Maximum number of estimated tokens to spend. Defaults to 0 (unlimited).
 
     Returns:
         None
@@ -459,48 +785,67 @@ async def create_tests_for_repo(
     logging.info("Successfully cloned repository into %s", local_dir)
     date = datetime.datetime.today().strftime("%A %B %d %Y, %X")
     logging.info("generating tests")
-    created_commit = False
-    for directory in local_dir.iterdir():
+    coverage_report = None
+    if use_coverage:
+        logging.info("Collecting coverage of existing tests")
+        coverage_report = CoverageReport.collect(local_dir)
+    budget = GenerationBudget(max_files=max_files, max_tokens=max_tokens)
+    directories = list(local_dir.iterdir())
+    if coverage_report:
+        directories.sort(key=lambda d: coverage_report.module_coverage(d.name))
+
+    test_index = ExistingTestIndex.build(
+        local_dir, exclude=dependency_graph.get_global_settings()["exclude"]
+    )
+
+    generated: dict[str, dict[Path, str]] = {}
+    for directory in directories:
+        if budget.exhausted():
+            logging.info("Generation budget exhausted")
+            break
         if (
             directory.is_dir()
             and directory.name not in dependency_graph.get_global_settings()["exclude"]
         ):
-            success = generate_tests(
+            files = generate_tests(
                 directory=local_dir,
                 dependency_graph=dependency_graph,
                 sub_path=directory,
                 test_dir=directory / "tests",
                 target_files=target_file_paths,
+                batch_token_limit=batch_token_limit,
+                coverage_report=coverage_report,
+                budget=budget,
+                test_index=test_index,
             )
-            if not success:
-                continue
-            
-            local_repo.index.add((directory / "tests").relative_to(local_dir))
-            local_repo.index.commit(
-                f"auto-generated tests for {directory.relative_to(local_dir)} on {date}"
-            )
-            logging.info(
-                f"Created commit with message: auto-generated tests for {directory.relative_to(local_dir)} on {date}"
-            )
-            created_commit = True
-    if not created_commit:
+            if files:
+                generated[str(directory.relative_to(local_dir))] = files
+
+    if not commit_generated_files(
+        local_repo, local_dir, generated, date, commit_policy=commit_policy
+    ):
         logging.info("No tests generated")
         return
     logging.info("Pushing to remote branch %s" % new_branch)
-    local_repo.remote().push("{}:{}".format(new_branch, new_branch)).raise_if_error()
 
-    logging.info("Successfully generated and pushed tests in %s", repo)
+    def push():
+        start = time.perf_counter()
+        local_repo.remote().push("{}:{}".format(new_branch, new_branch)).raise_if_error()
+        logging.info("Pushed %s in %.2fs", new_branch, time.perf_counter() - start)
+
+    # push in a worker thread while the pull request is being prepared.
+    push_task = asyncio.get_running_loop().run_in_executor(None, push)
+    body = pull_request_body(generated, local_dir)
 
     async with aiohttp.ClientSession(trust_env=True) as session:
         gh = GitHubAPI(session, username, oauth_token=os.getenv("GH_AUTH"))
+        await push_task
+        logging.info("Successfully generated and pushed tests in %s", repo)
         results = await gh.post(
             f"/repos/{repo}/pulls",
             data={
                 "title": f"Auto-tests generated by ibl.ai ⚡",
-                "body": """> [!IMPORTANT] \
-                        \n> Remember to check out the pull request and run the tests before merging. \
-                        \n> Thank you.
-                        """,
+                "body": body,
                 "head": f"{repo_username}:{new_branch}",
                 "base": branch,
             },
@@ -0,0 +1,305 @@
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, TypedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = Path.cwd() / "webhook-queue.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_repo ON jobs (repo, status);
+"""
+
+
+class Job(TypedDict):
+    id: int
+    kind: str
+    repo: str
+    payload: dict[str, Any]
+    attempts: int
+
+
+class WorkQueue:
+    """
+    A durable job queue stored in a local SQLite database.
+
+    Several processes may share the same database file. A claimed job is leased to a
+    worker for `lease_seconds`; if the worker dies without completing it, the lease
+    expires and the job becomes claimable again. Failed jobs are retried with an
+    exponential backoff until `max_attempts` is reached. At most one job per repository
+    is leased at any time so that two workers never work on the same clone.
+    """
+
+    def __init__(
+        self,
+        path: Path = DEFAULT_QUEUE_PATH,
+        lease_seconds: float = 15 * 60,
+        max_attempts: int = 3,
+        retry_delay: float = 30,
+    ):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, transactions are opened explicitly where needed.
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def enqueue(self, kind: str, payload: dict[str, Any], repo: str = "") -> int:
+        now = time.time()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs (kind, repo, payload, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, repo, json.dumps(payload), now, now, now),
+            )
+        logger.info("Queued %s job %d for %s", kind, cursor.lastrowid, repo or "-")
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Job | None:
+        """Leases the oldest available job whose repository is not already leased."""
+        now = time.time()
+        connection = self._connect()
+        try:
+            # take the write lock up front so that two workers cannot claim the same job.
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                "WHERE status = 'running' AND lease_until <= ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE available_at <= :now "
+                "AND (status = 'pending' OR (status = 'running' AND lease_until <= :now)) "
+                "AND (repo = '' OR repo NOT IN ("
+                "    SELECT repo FROM jobs WHERE status = 'running' AND lease_until > :now"
+                ")) ORDER BY id LIMIT 1",
+                {"now": now},
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "lease_until = ?, worker = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, worker, now, row["id"]),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "repo": row["repo"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def _update_leased(self, job_id: int, worker: str, sql: str, params: tuple) -> bool:
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                sql + " WHERE id = ? AND worker = ? AND status = 'running'",
+                (*params, job_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Extends the lease of a running job. Returns False if the lease was lost."""
+        now = time.time()
+        return self._update_leased(
+            job_id,
+            worker,
+            "UPDATE jobs SET lease_until = ?, updated_at = ?",
+            (now + self.lease_seconds, now),
+        )
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        return self._update_leased(
+            job_id,
+            worker,
+            "UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = ?",
+            (time.time(),),
+        )
+
+    def fail(self, job: Job, worker: str, error: str) -> bool:
+        """Schedules a retry of a failed job, or marks it failed after `max_attempts`."""
+        now = time.time()
+        if job["attempts"] >= self.max_attempts:
+            status, available_at = "failed", now
+        else:
+            status = "pending"
+            available_at = now + self.retry_delay * 2 ** (job["attempts"] - 1)
+        return self._update_leased(
+            job["id"],
+            worker,
+            "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, "
+            "error = ?, updated_at = ?",
+            (status, available_at, error, now),
+        )
+
+    def counts(self) -> dict[str, int]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+
+def _run_handler(handler: Callable[[Job], None], job: Job, connection):
+    try:
+        handler(job)
+    except BaseException:
+        # keep the message small enough not to block on a full pipe.
+        connection.send(traceback.format_exc()[-10000:])
+        raise
+    finally:
+        connection.close()
+
+
+def run_worker(
+    queue: WorkQueue,
+    handler: Callable[[Job], None],
+    worker: str | None = None,
+    poll_interval: float = 1.0,
+    stop=None,
+):
+    """
+    Processes jobs from `queue` until `stop` is set.
+
+    Meant to be the target of a worker process, in which case `stop` should be a
+    `multiprocessing.Event`. Each job runs in a child process while this process renews
+    its lease. Failed renewals are retried; if the lease is lost, or is about to expire
+    without a successful renewal, the job is terminated so that it never keeps running
+    once another worker may claim it or its repository.
+
+    Database errors (eg. "database is locked") never stop the worker: claims are
+    retried after `poll_interval`, and a job whose result cannot be recorded is picked
+    up again once its lease expires.
+    """
+    if worker is None:
+        worker = "worker-%d" % os.getpid()
+    if stop is None:
+        stop = threading.Event()
+    interval = queue.lease_seconds / 3
+    retry_interval = min(interval, 5)
+    logger.info("%s started", worker)
+    while not stop.is_set():
+        claimed_at = time.time()
+        try:
+            job = queue.claim(worker)
+        except sqlite3.Error as e:
+            logger.warning("%s failed to claim a job: %s", worker, e)
+            stop.wait(poll_interval)
+            continue
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        logger.info(
+            "%s running %s job %d (attempt %d)",
+            worker,
+            job["kind"],
+            job["id"],
+            job["attempts"],
+        )
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_run_handler, args=(handler, job, sender)
+        )
+        start = time.perf_counter()
+        process.start()
+        sender.close()
+
+        lease_until = claimed_at + queue.lease_seconds
+        wait = interval
+        lost = False
+        while True:
+            process.join(wait)
+            if not process.is_alive():
+                break
+            now = time.time()
+            try:
+                renewed = queue.heartbeat(job["id"], worker)
+            except sqlite3.Error as e:
+                logger.warning(
+                    "%s failed to renew the lease on job %d: %s", worker, job["id"], e
+                )
+                renewed = None
+            if renewed:
+                lease_until = now + queue.lease_seconds
+                wait = interval
+                continue
+            wait = retry_interval
+            if renewed is False or time.time() + wait >= lease_until:
+                logger.error(
+                    "%s lost the lease on job %d, stopping it", worker, job["id"]
+                )
+                process.terminate()
+                process.join()
+                lost = True
+                break
+
+        error = None
+        try:
+            if receiver.poll():
+                error = receiver.recv()
+        except EOFError:
+            # the handler exited without reporting an error.
+            pass
+        receiver.close()
+        if lost:
+            continue
+        if process.exitcode != 0:
+            logger.error("%s failed job %d\n%s", worker, job["id"], error or "")
+            try:
+                queue.fail(job, worker, error or "exit code %s" % process.exitcode)
+            except sqlite3.Error as e:
+                logger.error(
+                    "%s failed to record the failure of job %d: %s", worker, job["id"], e
+                )
+                stop.wait(poll_interval)
+            continue
+        try:
+            queue.complete(job["id"], worker)
+        except sqlite3.Error as e:
+            logger.error("%s failed to complete job %d: %s", worker, job["id"], e)
+            stop.wait(poll_interval)
+            continue
+        logger.info(
+            "%s finished job %d in %.2fs",
+            worker,
+            job["id"],
+            time.perf_counter() - start,
+        )
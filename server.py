@@ -1,4 +1,8 @@
+import asyncio
+import logging
+import multiprocessing
 import os
+import signal
 import aiohttp
 
 from aiohttp import web
@@ -6,10 +10,22 @@ from aiohttp import web
 from gidgethub import routing, sansio
 from gidgethub import aiohttp as gh_aiohttp
 
+from ibl_github_bot.work_queue import DEFAULT_QUEUE_PATH, Job, WorkQueue, run_worker
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 routes = web.RouteTableDef()
 
 router = routing.Router()
 
+# kind of the queued jobs holding a verified webhook event.
+WEBHOOK_JOB = "webhook"
+
+# seconds between checks that all worker processes are still alive.
+WORKER_CHECK_INTERVAL = 5
+
+
 @router.register("issues", action="opened")
 async def issue_opened_event(event, gh, *args, **kwargs):
     """
@@ -21,19 +37,84 @@ async def issue_opened_event(event, gh, *args, **kwargs):
     message = f"Thanks for the report @{author}! I will look into it ASAP! (I'm a bot)."
     await gh.post(url, data={"body": message})
 
+
+async def dispatch(event: sansio.Event):
+    oauth_token = os.environ.get("GH_AUTH")
+    async with aiohttp.ClientSession() as session:
+        gh = gh_aiohttp.GitHubAPI(session, "mariatta",
+                                  oauth_token=oauth_token)
+        await router.dispatch(event, gh)
+
+
+def handle_job(job: Job):
+    """Dispatches a queued webhook event in a worker process."""
+    if job["kind"] != WEBHOOK_JOB:
+        raise ValueError(f"Unknown job kind: {job['kind']}")
+    payload = job["payload"]
+    event = sansio.Event(
+        payload["data"], event=payload["event"], delivery_id=payload["delivery_id"]
+    )
+    asyncio.run(dispatch(event))
+
+
+def start_worker(queue: WorkQueue, stop):
+    # Ctrl-C reaches the whole process group; workers shut down through `stop` instead
+    # so that the job they are running is finished and its lease released.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(queue, handle_job, stop=stop)
+
+
+def spawn_worker(queue: WorkQueue, stop) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=start_worker, args=(queue, stop))
+    process.start()
+    return process
+
+
+async def supervise_workers(app: web.Application):
+    """Restarts worker processes that exit while the server is running."""
+
+    async def watch():
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            processes = app["workers"]
+            for i, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                process.join()
+                logger.warning(
+                    "Worker process %d exited with code %s, restarting it",
+                    process.pid,
+                    process.exitcode,
+                )
+                processes[i] = spawn_worker(app["queue"], app["stop"])
+
+    task = asyncio.create_task(watch())
+    yield
+    task.cancel()
+
+
 @routes.post("/")
 async def main(request):
     body = await request.read()
 
     secret = os.environ.get("GH_SECRET")
-    oauth_token = os.environ.get("GH_AUTH")
 
     event = sansio.Event.from_http(request.headers, body, secret=secret)
-    async with aiohttp.ClientSession() as session:
-        gh = gh_aiohttp.GitHubAPI(session, "mariatta",
-                                  oauth_token=oauth_token)
-        await router.dispatch(event, gh)
-    return web.Response(status=200)
+    queue: WorkQueue | None = request.app.get("queue")
+    if queue is None:
+        await dispatch(event)
+        return web.Response(status=200)
+
+    # hand the verified event over to the worker processes.
+    repo = event.data.get("repository", {}).get("full_name", "")
+    await asyncio.get_running_loop().run_in_executor(
+        None,
+        queue.enqueue,
+        WEBHOOK_JOB,
+        {"event": event.event, "delivery_id": event.delivery_id, "data": event.data},
+        repo,
+    )
+    return web.Response(status=202)
 
 
 if __name__ == "__main__":
@@ -43,4 +124,21 @@ if __name__ == "__main__":
     if port is not None:
         port = int(port)
 
-    web.run_app(app, port=port)
+    # with WORKERS > 0 webhooks are only verified and queued here, and handled by
+    # that many worker processes sharing a local SQLite queue.
+    workers = int(os.environ.get("WORKERS", 0))
+    stop = multiprocessing.Event()
+    app["workers"] = []
+    if workers > 0:
+        queue = WorkQueue(os.environ.get("QUEUE_PATH", DEFAULT_QUEUE_PATH))
+        app["queue"] = queue
+        app["stop"] = stop
+        app["workers"] = [spawn_worker(queue, stop) for _ in range(workers)]
+        app.cleanup_ctx.append(supervise_workers)
+
+    try:
+        web.run_app(app, port=port)
+    finally:
+        stop.set()
+        for process in app["workers"]:
+            process.join()
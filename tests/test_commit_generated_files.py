@@ -0,0 +1,103 @@
+import pytest
+
+git = pytest.importorskip("git")
+pytest.importorskip("langchain")
+
+from ibl_github_bot.tests_generator import (
+    commit_generated_files,
+    pull_request_body,
+    write_generated_files,
+)
+
+DATE = "Monday January 01 2024, 00:00:00"
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = git.Repo.init(tmp_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    (tmp_path / "README.md").write_text("readme")
+    repo.index.add(["README.md"])
+    repo.index.commit("initial commit")
+    return repo
+
+
+def generated_files(root):
+    return {
+        "app": {
+            root / "app/tests/__init__.py": "",
+            root / "app/tests/test_views.py": "def test_views():\n    pass\n",
+        },
+        "bot": {root / "bot/tests/test_models.py": "def test_models():\n    pass\n"},
+    }
+
+
+def test_write_generated_files_replaces_atomically(tmp_path):
+    path = tmp_path / "app/tests/test_views.py"
+    path.parent.mkdir(parents=True)
+    path.write_text("old")
+
+    write_generated_files({path: "new"})
+
+    assert path.read_text() == "new"
+    assert [p.name for p in path.parent.iterdir()] == ["test_views.py"]
+
+
+def test_single_policy_creates_one_commit(repo, tmp_path, monkeypatch):
+    added = []
+    add = git.IndexFile.add
+
+    def counting_add(index, items, *args, **kwargs):
+        added.append(items)
+        return add(index, items, *args, **kwargs)
+
+    monkeypatch.setattr(git.IndexFile, "add", counting_add)
+
+    messages = commit_generated_files(repo, tmp_path, generated_files(tmp_path), DATE)
+
+    assert len(added) == 1
+    assert len(messages) == 1
+    commit = repo.head.commit
+    assert commit.summary == f"auto-generated tests on {DATE}"
+    assert "- app\n- bot" in commit.message
+    assert sorted(commit.stats.files) == [
+        "app/tests/__init__.py",
+        "app/tests/test_views.py",
+        "bot/tests/test_models.py",
+    ]
+    assert len(list(repo.iter_commits())) == 2
+
+
+def test_module_policy_creates_one_commit_per_module(repo, tmp_path):
+    messages = commit_generated_files(
+        repo, tmp_path, generated_files(tmp_path), DATE, commit_policy="module"
+    )
+
+    assert messages == [
+        f"auto-generated tests for app on {DATE}",
+        f"auto-generated tests for bot on {DATE}",
+    ]
+    assert len(list(repo.iter_commits())) == 3
+    assert list(repo.head.commit.stats.files) == ["bot/tests/test_models.py"]
+
+
+def test_invalid_policy_raises(repo, tmp_path):
+    with pytest.raises(ValueError, match="Invalid commit policy"):
+        commit_generated_files(
+            repo, tmp_path, generated_files(tmp_path), DATE, commit_policy="squash"
+        )
+
+
+def test_nothing_generated_creates_no_commit(repo, tmp_path):
+    assert commit_generated_files(repo, tmp_path, {"app": {}}, DATE) == []
+    assert len(list(repo.iter_commits())) == 1
+
+
+def test_pull_request_body_lists_test_files(tmp_path):
+    body = pull_request_body(generated_files(tmp_path), tmp_path)
+
+    assert "- `app/tests/test_views.py`" in body
+    assert "- `bot/tests/test_models.py`" in body
+    assert "__init__.py" not in body
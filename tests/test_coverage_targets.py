@@ -0,0 +1,123 @@
+from pathlib import Path
+
+import pytest
+
+from ibl_github_bot.coverage_targets import (
+    CoverageReport,
+    GenerationBudget,
+    coverage_env,
+    format_line_ranges,
+)
+
+SOURCE = """\
+def covered():
+    return 1
+
+
+class Bot:
+    def uncovered(self):
+        return 2
+"""
+
+
+def make_entry(percent: float, missing: list[int]) -> dict:
+    return {"summary": {"percent_covered": percent}, "missing_lines": missing}
+
+
+def test_format_line_ranges():
+    assert format_line_ranges([7, 1, 2, 3, 9, 10]) == "1-3, 7, 9-10"
+    assert format_line_ranges([]) == ""
+
+
+def test_from_json_skips_test_files():
+    report = CoverageReport.from_json(
+        Path("/repo"),
+        {
+            "files": {
+                "app/models.py": make_entry(20.0, [1]),
+                "app/tests/test_models.py": make_entry(100.0, []),
+                "app/tests/conftest.py": make_entry(100.0, []),
+                "app/tests.py": make_entry(100.0, []),
+            }
+        },
+    )
+    assert list(report.files) == ["app/models.py"]
+    assert report.module_coverage("app") == 20.0
+    assert report.module_coverage("other") == 0.0
+
+
+def test_uncovered_functions_and_describe():
+    report = CoverageReport(Path("/repo"), {"app/bot.py": make_entry(50.0, [6, 7])})
+    path = Path("/repo/app/bot.py")
+
+    assert report.percent_covered(path) == 50.0
+    assert report.uncovered_functions(path, SOURCE) == ["Bot.uncovered"]
+    description = report.describe(path, SOURCE)
+    assert "Uncovered lines: 6-7." in description
+    assert "Uncovered functions: Bot.uncovered." in description
+
+
+def test_unmeasured_file_is_fully_uncovered():
+    report = CoverageReport(Path("/repo"), {})
+    path = Path("app/bot.py")
+
+    assert report.percent_covered(path) == 0.0
+    assert report.missing_lines(path, SOURCE) == [1, 2, 5, 6, 7]
+    assert report.uncovered_functions(path, SOURCE) == ["covered", "Bot.uncovered"]
+
+
+def test_budget_unlimited():
+    budget = GenerationBudget()
+    budget.consume(files=100, tokens=10**6)
+    assert not budget.exhausted()
+    assert budget.remaining_files() is None
+
+
+def test_budget_files():
+    budget = GenerationBudget(max_files=3)
+    budget.consume(files=2)
+    assert budget.remaining_files() == 1
+    assert not budget.exhausted()
+    budget.consume(files=1)
+    assert budget.remaining_files() == 0
+    assert budget.exhausted()
+
+
+def test_budget_tokens():
+    budget = GenerationBudget(max_tokens=100)
+    budget.consume(tokens=99)
+    assert not budget.exhausted()
+    budget.consume(tokens=1)
+    assert budget.exhausted()
+
+
+def test_coverage_env_drops_secrets(monkeypatch):
+    for name in ["GH_TOKEN", "GH_AUTH", "GH_USERNAME", "OPENAI_API_KEY"]:
+        monkeypatch.setenv(name, "secret")
+    monkeypatch.setenv("PATH", "/usr/bin")
+
+    env = coverage_env(Path("/tmp/.coverage"))
+
+    assert env["PATH"] == "/usr/bin"
+    assert env["COVERAGE_FILE"] == "/tmp/.coverage"
+    assert "secret" not in env.values()
+
+
+def test_collect_runs_tests_without_secrets(tmp_path, monkeypatch):
+    pytest.importorskip("coverage")
+    monkeypatch.setenv("GH_TOKEN", "secret")
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app/__init__.py").write_text("")
+    (tmp_path / "app/bot.py").write_text(SOURCE)
+    (tmp_path / "test_bot.py").write_text(
+        "import os\n"
+        "from app.bot import covered\n\n"
+        "def test_covered():\n"
+        "    assert 'GH_TOKEN' not in os.environ\n"
+        "    assert covered() == 1\n"
+    )
+
+    report = CoverageReport.collect(tmp_path)
+
+    assert sorted(report.files) == ["app/__init__.py", "app/bot.py"]
+    assert report.missing_lines(Path("app/bot.py"), SOURCE) == [7]
@@ -0,0 +1,40 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("gidgethub")
+
+import server
+
+
+def test_handle_job_rejects_unknown_kinds():
+    job = {"id": 1, "kind": "other", "repo": "", "payload": {}, "attempts": 1}
+    with pytest.raises(ValueError, match="Unknown job kind"):
+        server.handle_job(job)
+
+
+class AliveProcess:
+    def is_alive(self):
+        return True
+
+
+def test_supervise_workers_restarts_dead_workers(monkeypatch):
+    dead = multiprocessing.Process(target=int)
+    dead.start()
+    dead.join()
+    replacement = AliveProcess()
+    monkeypatch.setattr(server, "WORKER_CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(server, "spawn_worker", lambda queue, stop: replacement)
+    app = {"workers": [dead], "queue": None, "stop": None}
+
+    async def run():
+        supervisor = server.supervise_workers(app)
+        await supervisor.__anext__()
+        await asyncio.sleep(0.05)
+        with pytest.raises(StopAsyncIteration):
+            await supervisor.__anext__()
+
+    asyncio.run(run())
+    assert app["workers"] == [replacement]
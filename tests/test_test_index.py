@@ -0,0 +1,98 @@
+from pathlib import Path
+
+from ibl_github_bot.test_index import ExistingTestIndex, is_test_file
+
+
+def write(root: Path, path: str, content: str = ""):
+    (root / path).parent.mkdir(parents=True, exist_ok=True)
+    (root / path).write_text(content)
+
+
+def test_is_test_file():
+    assert is_test_file(Path("app/tests/test_views.py"))
+    assert is_test_file(Path("app/views_test.py"))
+    assert is_test_file(Path("app/tests.py"))
+    assert not is_test_file(Path("app/views.py"))
+    assert not is_test_file(Path("app/tests/test_data.json"))
+
+
+def test_build_matches_by_name_and_import(tmp_path):
+    for path in [
+        "app/__init__.py",
+        "app/models.py",
+        "app/views.py",
+        "app/api/__init__.py",
+        "app/api/views.py",
+        "app/tests/__init__.py",
+    ]:
+        write(tmp_path, path)
+    write(tmp_path, "app/tests/test_api_views.py", "from ..api import views\n")
+    write(tmp_path, "app/tests/test_views.py", "from app.models import Bot\n")
+    write(tmp_path, "app/tests.py", "import app.views\n")
+    write(tmp_path, ".git/hooks/test_hook.py")
+    index = ExistingTestIndex.build(tmp_path)
+
+    assert index.named_tests_for(tmp_path / "app/api/views.py") == [
+        tmp_path / "app/tests/test_api_views.py"
+    ]
+    # also imported, but reported once as a name match.
+    assert index.imported_tests_for(tmp_path / "app/api/views.py") == []
+    assert index.named_tests_for(tmp_path / "app/views.py") == [
+        tmp_path / "app/tests/test_views.py"
+    ]
+    assert index.imported_tests_for(tmp_path / "app/views.py") == [
+        tmp_path / "app/tests.py"
+    ]
+    assert index.named_tests_for(tmp_path / "app/models.py") == []
+    assert index.imported_tests_for(tmp_path / "app/models.py") == [
+        tmp_path / "app/tests/test_views.py"
+    ]
+    assert tmp_path / ".git/hooks/test_hook.py" not in index.test_files
+
+
+def test_read_caches_contents(tmp_path):
+    write(tmp_path, "app/views.py")
+    write(tmp_path, "app/test_views.py", "def test_views(): pass\n")
+    index = ExistingTestIndex.build(tmp_path)
+    test_file = tmp_path / "app/test_views.py"
+
+    assert index.named_tests_for(tmp_path / "app/views.py") == [test_file]
+    test_file.write_text("changed")
+    assert index.read(test_file) == "def test_views(): pass\n"
+
+
+def test_unparsable_test_file_is_skipped(tmp_path):
+    write(tmp_path, "app/views.py")
+    write(tmp_path, "app/test_views.py", "import (\n")
+    index = ExistingTestIndex.build(tmp_path)
+
+    assert index.test_files == set()
+    assert index.named_tests_for(tmp_path / "app/views.py") == []
+
+
+def test_coding_declaration_is_honoured(tmp_path):
+    write(tmp_path, "app/views.py")
+    (tmp_path / "app/test_views.py").write_bytes(
+        b"# -*- coding: latin-1 -*-\nNAME = '\xe9'\n"
+    )
+    (tmp_path / "app/tests").mkdir()
+    (tmp_path / "app/tests/test_other.py").write_bytes(b"NAME = '\xe9'\n")
+    index = ExistingTestIndex.build(tmp_path)
+
+    test_file = tmp_path / "app/test_views.py"
+    assert index.named_tests_for(tmp_path / "app/views.py") == [test_file]
+    assert "\u00e9" in index.read(test_file)
+    # invalid utf-8 without a declaration is skipped instead of aborting the run.
+    assert index.test_files == {test_file}
+
+
+def test_build_skips_configured_excludes(tmp_path):
+    write(tmp_path, "app/views.py")
+    write(tmp_path, "app/tests/test_views.py", "import app.views\n")
+    write(tmp_path, "app/migrations/test_0001.py", "import app.views\n")
+    write(tmp_path, "legacy/app/test_views.py", "import app.views\n")
+    index = ExistingTestIndex.build(
+        tmp_path, exclude=["tests", "tests.py", "migrations", "legacy/app"]
+    )
+
+    assert index.test_files == {tmp_path / "app/tests/test_views.py"}
@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.schema import Document
+
+from ibl_github_bot.tests_generator import (
+    BATCH_FILE_MARKER,
+    CodeParser,
+    batch_documents,
+)
+
+
+def test_parse_many_splits_and_validates_each_file():
+    text = "\n".join(
+        [
+            "Here are the tests:",
+            f"{BATCH_FILE_MARKER} app/apps.py",
+            "```python",
+            "def test_apps():",
+            "    pass",
+            "```",
+            f"{BATCH_FILE_MARKER} `app/urls.py`",
+            "```python",
+            "def test_urls(:",
+            "```",
+        ]
+    )
+    results = CodeParser().parse_many(text, ["app/apps.py", "app/urls.py", "app/admin.py"])
+
+    assert results["app/apps.py"] == ("def test_apps():\n    pass", True)
+    assert results["app/urls.py"][1] is False
+    assert results["app/admin.py"] == ("", False)
+
+
+def test_parse_many_ignores_unexpected_files():
+    text = f"{BATCH_FILE_MARKER} other.py\n```python\nx = 1\n```"
+    assert CodeParser().parse_many(text, ["app/apps.py"]) == {"app/apps.py": ("", False)}
+
+
+def make_document(size: int, name: str) -> Document:
+    return Document(page_content="x" * size, metadata={"source": name})
+
+
+def test_batch_documents_disabled():
+    documents = [make_document(4, "a"), make_document(4, "b")]
+    assert batch_documents(documents) == [[documents[0]], [documents[1]]]
+
+
+def test_batch_documents_groups_up_to_limit():
+    # 40 characters ~ 10 tokens each
+    small = [make_document(40, name) for name in "abc"]
+    large = make_document(400, "large")
+    batches = batch_documents([small[0], large, small[1], small[2]], token_limit=25)
+
+    assert batches == [[large], [small[0], small[1]], [small[2]]]
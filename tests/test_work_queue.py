@@ -0,0 +1,235 @@
+import multiprocessing
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+from ibl_github_bot.work_queue import WorkQueue, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(tmp_path / "queue.sqlite3", retry_delay=0)
+
+
+def set_column(queue: WorkQueue, job_id: int, column: str, value):
+    with closing(sqlite3.connect(queue.path, isolation_level=None)) as connection:
+        connection.execute(f"UPDATE jobs SET {column} = ? WHERE id = ?", (value, job_id))
+
+
+def test_claim_in_order(queue):
+    first = queue.enqueue("webhook", {"n": 1}, "org/a")
+    second = queue.enqueue("webhook", {"n": 2}, "org/b")
+
+    job = queue.claim("w1")
+    assert job["id"] == first
+    assert job["payload"] == {"n": 1}
+    assert job["attempts"] == 1
+    assert queue.claim("w2")["id"] == second
+    assert queue.claim("w3") is None
+
+
+def test_one_running_job_per_repo(queue):
+    first = queue.enqueue("webhook", {}, "org/a")
+    queue.enqueue("webhook", {}, "org/a")
+    other = queue.enqueue("webhook", {}, "org/b")
+
+    assert queue.claim("w1")["id"] == first
+    assert queue.claim("w2")["id"] == other
+    assert queue.claim("w3") is None
+    assert queue.complete(first, "w1")
+    assert queue.claim("w3")["repo"] == "org/a"
+
+
+def test_jobs_without_repo_are_not_locked(queue):
+    queue.enqueue("webhook", {})
+    queue.enqueue("webhook", {})
+
+    assert queue.claim("w1") is not None
+    assert queue.claim("w2") is not None
+
+
+def test_fail_retries_until_max_attempts(queue):
+    job_id = queue.enqueue("webhook", {}, "org/a")
+    for _ in range(queue.max_attempts - 1):
+        job = queue.claim("w1")
+        assert queue.fail(job, "w1", "boom")
+        assert queue.counts() == {"pending": 1}
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["attempts"] == queue.max_attempts
+    assert queue.fail(job, "w1", "boom")
+    assert queue.counts() == {"failed": 1}
+    assert queue.claim("w1") is None
+
+
+def test_fail_backs_off(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3", retry_delay=60)
+    queue.enqueue("webhook", {}, "org/a")
+    queue.fail(queue.claim("w1"), "w1", "boom")
+
+    assert queue.claim("w1") is None
+
+
+def test_expired_lease_is_reclaimed(queue):
+    job_id = queue.enqueue("webhook", {}, "org/a")
+    queue.claim("w1")
+    set_column(queue, job_id, "lease_until", time.time() - 1)
+
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    # the previous worker lost its lease.
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job_id, "w1")
+    assert queue.heartbeat(job_id, "w2")
+    assert queue.complete(job_id, "w2")
+
+
+def test_expired_lease_after_max_attempts_fails(queue):
+    job_id = queue.enqueue("webhook", {}, "org/a")
+    queue.claim("w1")
+    set_column(queue, job_id, "attempts", queue.max_attempts)
+    set_column(queue, job_id, "lease_until", time.time() - 1)
+
+    assert queue.claim("w2") is None
+    assert queue.counts() == {"failed": 1}
+
+
+def record(job):
+    Path(job["payload"]["path"]).write_text("done")
+
+
+def crash(job):
+    raise RuntimeError("boom")
+
+
+def slow(job):
+    time.sleep(2)
+    Path(job["payload"]["path"]).write_text("done")
+
+
+def run_in_thread(queue: WorkQueue, handler, until, timeout: float = 10):
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=run_worker,
+        args=(queue, handler),
+        kwargs={"worker": "w1", "poll_interval": 0.05, "stop": stop},
+    )
+    thread.start()
+    deadline = time.time() + timeout
+    while not until() and time.time() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    thread.join()
+
+
+def test_run_worker_completes_jobs(queue, tmp_path):
+    paths = [tmp_path / f"{i}.txt" for i in range(3)]
+    for path in paths:
+        queue.enqueue("webhook", {"path": str(path)}, "org/a")
+
+    run_in_thread(queue, record, lambda: queue.counts().get("done") == 3)
+    assert queue.counts() == {"done": 3}
+    assert all(path.exists() for path in paths)
+
+
+def test_run_worker_records_failures(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3", retry_delay=0, max_attempts=2)
+    queue.enqueue("webhook", {}, "org/a")
+
+    run_in_thread(queue, crash, lambda: queue.counts().get("failed") == 1)
+    assert queue.counts() == {"failed": 1}
+    with closing(sqlite3.connect(queue.path)) as connection:
+        (error,) = connection.execute("SELECT error FROM jobs").fetchone()
+    assert "RuntimeError: boom" in error
+
+
+def test_run_worker_stops_job_when_lease_is_lost(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3", lease_seconds=0.3)
+    path = tmp_path / "done.txt"
+    job_id = queue.enqueue("webhook", {"path": str(path)}, "org/a")
+
+    def steal_lease():
+        time.sleep(0.2)
+        set_column(queue, job_id, "worker", "w2")
+        set_column(queue, job_id, "lease_until", time.time() + 60)
+
+    thief = threading.Thread(target=steal_lease)
+    thief.start()
+    started = time.time()
+    run_in_thread(queue, slow, lambda: time.time() - started > 0.5, timeout=3)
+    thief.join()
+
+    assert time.time() - started < 1.5
+    time.sleep(2)
+    assert not path.exists()
+    assert queue.counts() == {"running": 1}
+
+
+def test_run_worker_stops_job_before_lease_expires_on_errors(tmp_path, monkeypatch):
+    queue = WorkQueue(tmp_path / "queue.sqlite3", lease_seconds=0.6)
+    path = tmp_path / "done.txt"
+    job_id = queue.enqueue("webhook", {"path": str(path)}, "org/a")
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(queue, "heartbeat", locked)
+    started = time.time()
+    run_in_thread(queue, slow, lambda: False, timeout=0.1)
+
+    # the job was stopped well before the handler could finish.
+    assert time.time() - started < 1.5
+    time.sleep(2)
+    assert not path.exists()
+    with closing(sqlite3.connect(queue.path)) as connection:
+        (lease_until,) = connection.execute(
+            "SELECT lease_until FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    assert lease_until < time.time()
+
+
+def test_run_worker_survives_database_errors(queue, tmp_path, monkeypatch):
+    paths = [tmp_path / f"{i}.txt" for i in range(2)]
+    for i, path in enumerate(paths):
+        queue.enqueue("webhook", {"path": str(path)}, f"org/{i}")
+    claim, complete = queue.claim, queue.complete
+    errors = {"claim": 1, "complete": 1}
+
+    def flaky(name, call):
+        def wrapper(*args):
+            if errors[name]:
+                errors[name] -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return call(*args)
+
+        return wrapper
+
+    monkeypatch.setattr(queue, "claim", flaky("claim", claim))
+    monkeypatch.setattr(queue, "complete", flaky("complete", complete))
+    run_in_thread(queue, record, lambda: queue.counts().get("done") == 1)
+
+    assert errors == {"claim": 0, "complete": 0}
+    assert all(path.exists() for path in paths)
+    # the job that could not be completed keeps its lease until it expires.
+    assert queue.counts() == {"done": 1, "running": 1}
+
+
+def start_child(job):
+    child = multiprocessing.Process(target=record, args=(job,))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+
+
+def test_run_worker_jobs_can_start_processes(queue, tmp_path):
+    path = tmp_path / "done.txt"
+    queue.enqueue("webhook", {"path": str(path)}, "org/a")
+
+    run_in_thread(queue, start_child, lambda: queue.counts().get("done") == 1)
+    assert queue.counts() == {"done": 1}
+    assert path.exists()